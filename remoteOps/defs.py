@@ -3,8 +3,71 @@
 # >>>      written for QISkit circuit objects        <<< #
 # ====================================================== #
 
+from functools import lru_cache
+
 import qiskit.circuit as qc
 
+# Number of (qubits, clbits, params) taken by each custom instruction.
+_INSTR_SPEC = {
+    'RemoteCX':  (4, 2, 0),
+    'RemoteRZZ': (4, 2, 1),
+    'RemoteCRZ': (4, 2, 1),
+    'Teleport':  (4, 2, 0),
+    'GenEPR':    (2, 0, 0)
+}
+
+def _make_instr(name, params):
+    '''
+    Build a new instance of the named custom instruction.
+    Args:
+        name: Str, names the instruction (see _INSTR_SPEC).
+        params: Tuple of instruction params.
+    Returns:
+        A qc.Instruction object.
+    '''
+    num_qubits, num_clbits, _ = _INSTR_SPEC[name]
+    return qc.Instruction(name, num_qubits, num_clbits, list(params))
+
+def _get_reg(circ, reg, cls, default_name):
+    '''
+    Shared body of get_cregs/get_qregs.
+    Args:
+        circ: A QuantumCircuit object
+        reg: A register of type cls, name string, or None.
+        cls: qc.ClassicalRegister or qc.QuantumRegister.
+        default_name: Str, register name used when reg is None.
+    Returns:
+        reg: A register of type cls, found in or appended to circ.
+        reg_added: Bool, True if reg was appended to circ.
+    Raises:
+        ValueError: If the register isn't of size 2, or a different
+            register of the same name is already in circ.
+    '''
+    if reg is None:
+        reg = default_name
+    if isinstance(reg, str):
+        name = reg
+    else:
+        name = reg.name
+        if len(reg)!=2:
+            raise ValueError(f"EPR register '{name}' must have size 2, not {len(reg)}")
+
+    # Names are matched first, as they must be unique within circ.
+    existing = circ.cregs if cls is qc.ClassicalRegister else circ.qregs
+    for r in existing:
+        if r.name==name:
+            if len(r)!=2:
+                raise ValueError(f"EPR register '{name}' must have size 2, not {len(r)}")
+            if not isinstance(reg, str) and r!=reg:
+                raise ValueError(f"circ already has a different register named '{name}'")
+            return r, False
+
+    if isinstance(reg, str):
+        reg = cls(2,reg)
+    circ.add_register(reg)
+    
+    return reg, True
+
 def get_cregs(circ, creg):
     '''
     Utility to test if circ has creg.
@@ -13,53 +76,35 @@ def get_cregs(circ, creg):
     Args:
         circ: A QuantumCircuit object
         creg: Either a ClassicalRegister object, or name string.
+            If None, the default 'c_epr' register is used.
     Returns:
         creg: A ClassicalRegister object.
+        reg_added: Bool, True if creg was appended to circ.
+    Raises:
+        ValueError: If the register found or given isn't of size 2.
     Side-effects:
         creg appended to circ.
     '''
-    reg_added = False
-    if type(creg)==str:
-        # If we're given a creg NAME as string
-        has_creg = circ.has_register(qc.ClassicalRegister(2,creg))
-    else:
-        # Otherwise, assume creg is given as a ClassicalRegister
-        has_creg = circ.has_register(creg)
-
-    if creg==None or not has_creg:
-        reg_added = True
-        creg = qc.ClassicalRegister(2,'c_epr')
-        circ.add_register(creg)
-    
-    return creg, reg_added
+    return _get_reg(circ, creg, qc.ClassicalRegister, 'c_epr')
 
 def get_qregs(circ, qreg):
     '''
-    Utility to test if circ has creg.
+    Utility to test if circ has qreg.
     If it doesn't, append one to circ such that
     EPR-mediated operations can occur.
     Args:
         circ: A QuantumCircuit object
         qreg: Either a QuantumRegister object, or name string.
+            If None, the default 'q_epr' register is used.
     Returns:
         qreg: A QuantumRegister object.
+        reg_added: Bool, True if qreg was appended to circ.
+    Raises:
+        ValueError: If the register found or given isn't of size 2.
     Side-effects:
         qreg appended to circ.
     '''
-    reg_added = False
-    if type(qreg)==str:
-        # If we're given a qreg NAME as string
-        has_qreg = circ.has_register(qc.QuantumRegister(2,qreg))
-    else:
-        # Otherwise, assume qreg is given as a QuantumRegister
-        has_qreg = circ.has_register(qreg)
-
-    if qreg==None or not has_qreg:
-        reg_added = True
-        qreg = qc.QuantumRegister(2,'q_epr')
-        circ.add_register(qreg)
-    
-    return qreg, reg_added
+    return _get_reg(circ, qreg, qc.QuantumRegister, 'q_epr')
         
 
 def setAncilla(circ, epr0, epr1, creg=None):
@@ -115,8 +160,9 @@ def buildRemoteZZ(circ, phi, qb1, qb2, epr0, epr1, creg):
     circ.cnot(qb1,epr0)
     circ.cnot(qb2,epr1)
 
+    # Correct epr1 with epr0's outcome: epr1 then holds the parity of qb1,qb2.
     circ.measure(epr0,creg[0])
-    circ.x(epr1).c_if(creg[1],1)
+    circ.x(epr1).c_if(creg[0],1)
 
     circ.rz(phi,epr1)
     circ.h(epr1)
@@ -125,6 +171,7 @@ def buildRemoteZZ(circ, phi, qb1, qb2, epr0, epr1, creg):
     circ.z(qb1).c_if(creg[1],1)
     circ.z(qb2).c_if(creg[1],1)
 
+    # Return the measured EPR pair to |00>, ready for the next GenEPR.
     circ.x(epr0).c_if(creg[0],1)
     circ.x(epr1).c_if(creg[1],1)
 
@@ -181,8 +228,138 @@ def buildTeleportation(circ, source, targ, epr0, epr1, creg):
 
     circ.swap(epr1,targ)
 
+
+# Placeholder angle for parameterized templates, bound in decompose.
+_PHI = qc.Parameter('_remoteOps_phi')
+
+def _build_template(builder, n_qubits, n_clbits, params=()):
+    '''
+    Build a standalone expansion of a custom instruction,
+    flattened into bit indices so it can be replayed on any circuit.
+    Qubits are ordered as in addInstr: [qb1, qb2, epr0, epr1].
+    Args:
+        builder: One of the build* functions above.
+        n_qubits, n_clbits: Width of the custom instruction.
+        params: Tuple, leading params passed to builder.
+    Returns:
+        tpl: List of (operation, qubit indices, clbit indices, condition),
+            where condition is None or a (clbit index, value) pair.
+    '''
+    circ = qc.QuantumCircuit(n_qubits, n_clbits)
+    args = list(params)+circ.qubits
+    if n_clbits:
+        args.append(circ.clbits)
+    builder(circ, *args)
+
+    tpl = []
+    for op in circ.data:
+        obj = op.operation
+        cond = None
+        if obj.condition is not None:
+            cond = (circ.find_bit(obj.condition[0]).index, obj.condition[1])
+        tpl.append((obj,
+                    tuple(circ.find_bit(q).index for q in op.qubits),
+                    tuple(circ.find_bit(c).index for c in op.clbits),
+                    cond))
+    return tpl
+
+# Prebuilt expansions, replayed onto the circuit by decompose.
+_TEMPLATES = {
+    'RemoteCX':  _build_template(buildRemoteCX, 4, 2),
+    'RemoteRZZ': _build_template(buildRemoteZZ, 4, 2, (_PHI,)),
+    'RemoteCRZ': _build_template(buildRemoteCRZ, 4, 2, (_PHI,)),
+    'Teleport':  _build_template(buildTeleportation, 4, 2),
+    'GenEPR':    _build_template(setAncilla, 2, 0)
+}
+
+def _bind_phi(param, phi):
+    '''
+    Substitute phi for the template placeholder in param.
+    Fully bound expressions are returned as floats.
+    '''
+    if not isinstance(param, qc.ParameterExpression) or _PHI not in param.parameters:
+        return param
+    param = param.assign(_PHI, phi)
+    if not param.parameters:
+        param = float(param)
+    return param
+
+# Bound on the number of (name, params) combinations kept by _bound_params.
+_BIND_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=_BIND_CACHE_SIZE)
+def _bound_params(name, params):
+    '''
+    Params of each _TEMPLATES[name] entry, with phi=params[0] substituted.
+    Bound values are floats or ParameterExpressions, both immutable,
+    so they can be shared between expansions.
+    Args:
+        name: Str, names the custom instruction (see _TEMPLATES).
+        params: Tuple of custom instruction params.
+    Returns:
+        Tuple holding one params tuple per template entry.
+    '''
+    return tuple(tuple(_bind_phi(p, params[0]) for p in obj.params)
+                 for obj, _, _, _ in _TEMPLATES[name])
+
+def _expand(name, qubits, clbits, params):
+    '''
+    Expand a custom instruction into CircuitInstruction objects.
+    Template operations are copied, never handed out, since gates are mutable.
+    Args:
+        name: Str, names the custom instruction (see _TEMPLATES).
+        qubits, clbits: Bits the custom instruction acts on.
+        params: List of custom instruction params.
+    Returns:
+        List of qc.CircuitInstruction objects.
+    Raises:
+        ValueError: If params doesn't hold the number of params name takes.
+    '''
+    # Otherwise the template placeholder would leak into the circuit.
+    if len(params)!=_INSTR_SPEC[name][2]:
+        raise ValueError(f"{name} takes {_INSTR_SPEC[name][2]} params, got {len(params)}")
+    bound = _bound_params(name, tuple(params)) if params else None
+    ops = []
+    for pos, (obj, qidx, cidx, cond) in enumerate(_TEMPLATES[name]):
+        obj = obj.copy()
+        if bound and obj.params:
+            obj.params = list(bound[pos])
+        if cond is not None:
+            obj.condition = (clbits[cond[0]], cond[1])
+        ops.append(qc.CircuitInstruction(obj,
+                                         tuple(qubits[i] for i in qidx),
+                                         tuple(clbits[i] for i in cidx)))
+    return ops
+
+def _remote_ops(name, qb1, qb2, params, creg, qreg, epr_ready=False):
+    '''
+    Operations making up one addInstr call: a GenEPR on qreg, unless
+    epr_ready, followed by the named instruction (unless it's GenEPR).
+    Registers must already be resolved, see get_cregs/get_qregs.
+    Args:
+        name: Str, names the custom instruction (see _INSTR_SPEC).
+        qb1,qb2: Qubits targeted by the custom instruction.
+        params: Tuple of instruction params.
+        creg, qreg: EPR registers, of size 2.
+        epr_ready: Bool, if True qreg already holds an EPR pair.
+    Returns:
+        List of qc.CircuitInstruction objects.
+    '''
+    ops = []
+    if not epr_ready:
+        ops.append(qc.CircuitInstruction(_make_instr('GenEPR', ()), tuple(qreg), ()))
+    if name!='GenEPR':
+        ops.append(qc.CircuitInstruction(_make_instr(name, params),
+                                         (qb1, qb2, qreg[0], qreg[1]), tuple(creg)))
+    return ops
+
+# Native gates autosubstitute knows how to replace, and their EPR-mediated counterpart.
+_SUBST = {
+    'cx': 'RemoteCX'
+}
+
  
-def addInstr(circ, name, qb1=None, qb2=None, params=[], epr_creg=None, epr_qreg=None):
+def addInstr(circ, name, qb1=None, qb2=None, params=None, epr_creg=None, epr_qreg=None, epr_ready=False):
     '''
     Convenience method to add custom instructions.
 
@@ -194,36 +371,39 @@ def addInstr(circ, name, qb1=None, qb2=None, params=[], epr_creg=None, epr_qreg=
     EPR-mediated operations. If omitted, this method will add one.
     Generally, qb1 "talks directly to" epr_qreg[0] and qb2 to epr_qreg[1].
 
+    A GenEPR instruction is inserted ahead of the named instruction,
+    unless epr_ready is set. Remote operations consume (and reset) the
+    EPR pair, so callers skipping GenEPR must sequence a fresh one
+    themselves before every remote operation.
+
     Args:
         circ: A QISkit circuit object
         name: Str, names the new instruction.
         qb1,qb2: Qubits targeted by the custom instruction.
         params: List, specifies any relevant params for the instruction.
+            Defaults to no params.
         epr_qreg: Extra qreg to hold and facilitate EPR operations.
         epr_creg: Companion creg for EPR operations.
+        epr_ready: Bool, if True epr_qreg already holds an EPR pair,
+            and no GenEPR is added.
     Returns:
         circ: An updated QISkit circuit with the named instruction added.
+    Raises:
+        ValueError: If name is not a known custom instruction,
+            or params doesn't hold the number of params it takes.
     '''
+    if name not in _INSTR_SPEC:
+        raise ValueError(f"Undefined instruction: {name}")
+    params = () if params is None else tuple(params)
+    if len(params)!=_INSTR_SPEC[name][2]:
+        raise ValueError(f"{name} takes {_INSTR_SPEC[name][2]} params, got {len(params)}")
     
     # If a creg/qreg isn't specified for EPR operation, add it.
     creg, _ = get_cregs(circ, epr_creg)
     qreg, _ = get_qregs(circ, epr_qreg)
 
-    instrSet = {
-        'RemoteCX':    qc.Instruction('RemoteCX', 4, 2, params),
-        'RemoteRZZ':   qc.Instruction('RemoteRZZ',4, 2, params),
-        'RemoteCRZ':   qc.Instruction('RemoteCRZ',4, 2, params),
-        'Teleport':    qc.Instruction('Teleport', 4, 2, params),
-        'GenEPR':      qc.Instruction('GenEPR',  2, 0, params)
-    }
-
-    qargs = [qb1, qb2, qreg[0], qreg[1]]
-    circ.append(instrSet['GenEPR'], qreg, [])
-    if name!='GenEPR':
-        try:
-            circ.append(instrSet[name], qargs, creg)
-        except:
-            raise BaseException("Undefined instruction!")
+    for op in _remote_ops(name, qb1, qb2, params, creg, qreg, epr_ready):
+        circ.append(op.operation, op.qubits, op.clbits)
 
 
 def decompose(circ, gates=['RemoteCX','RemoteRZZ','RemoteCRZ','Teleport','GenEPR']):
@@ -231,35 +411,16 @@ def decompose(circ, gates=['RemoteCX','RemoteRZZ','RemoteCRZ','Teleport','GenEPR
     Replace custom instructions with basic QISkit ops.
     '''
     circuitChunks = []
-    emptyCirc = circ.copy()
-    emptyCirc.data = []
-    idx = 0
-
-    idxStart = 0
-    tempCirc = emptyCirc.copy()
-    for idx,op in enumerate(circ.data):
-        obj = op[0]
-        if obj.name in gates:
-            circuitChunks.extend(circ[idxStart:idx])
-            idxStart = idx+1
-
-            args = op[0].params+op[1]+[op[2]]
-            
-            if obj.name=='RemoteCX':
-                buildRemoteCX(tempCirc,*args)
-            elif obj.name=='RemoteRZZ':
-                buildRemoteZZ(tempCirc,*args)
-            elif obj.name=='RemoteCRZ':
-                buildRemoteCRZ(tempCirc,*args)
-            elif obj.name=='Teleport':
-                buildTeleportation(tempCirc,*args)
-            elif obj.name=='GenEPR':
-                setAncilla(tempCirc,*args)
-            
-            circuitChunks.extend(tempCirc)
-            tempCirc = emptyCirc.copy()
-    
-    circuitChunks.extend(circ[idxStart:])
+    expandable = frozenset(gates).intersection(_TEMPLATES)
+
+    # Single pass: keep ops as-is, or swap in their expansion.
+    for op in circ.data:
+        # Attribute access, as op[i] rebuilds the legacy (op, qargs, cargs) tuple.
+        obj = op.operation
+        if obj.name in expandable:
+            circuitChunks.extend(_expand(obj.name, op.qubits, op.clbits, obj.params))
+        else:
+            circuitChunks.append(op)
     
     circ.data = circuitChunks
 
@@ -275,33 +436,37 @@ def autosubstitute(circ, reglist, gates=['cx'], epr_qreg=None, epr_creg=None):
     qreg, _ = get_qregs(circ, epr_qreg)
 
     circuitChunks = []
-    emptyCirc = circ.copy()
-    emptyCirc.data = []
-    idx = 0
-
-    idxStart = 0
-    tempCirc = emptyCirc.copy()
-    for idx,op in enumerate(circ.data):
-        obj = op[0]
-        if len(op[1])==2: # Two qargs indicating 2-qb gate.
-            # Check if qargs are in reglist given.
-            # Only proceed if they are.
-            substitute = False
-            if op[1][0] in reglist[0] and op[1][1] in reglist[1]:
-                substitute = True
-            elif op[1][1] in reglist[0] and op[1][0] in reglist[1]:
-                substitute = True
-
-            if obj.name in gates and substitute==True:
-                circuitChunks.extend(circ[idxStart:idx])
-                idxStart = idx+1
-                
-                if obj.name=='cx':
-                    addInstr(tempCirc, 'RemoteCX', op[1][0], op[1][1], [], creg, qreg)
-                
-                circuitChunks.extend(tempCirc)
-                tempCirc = emptyCirc.copy()
-    
-    circuitChunks.extend(circ[idxStart:])
+
+    # Single pass: keep ops as-is, or swap in their EPR-mediated version.
+    # Hashed lookups, rather than scanning registers for every op.
+    left = set(reglist[0])
+    right = set(reglist[1])
+    substitutable = frozenset(gates).intersection(_SUBST)
+    eprQubits = tuple(qreg)
+    eprSet = set(eprQubits)
+    # True while the EPR bus holds an unused pair, i.e. right after
+    # an explicit GenEPR. A second GenEPR would then undo the first.
+    eprReady = False
+    for op in circ.data:
+        obj = op.operation
+        qargs = op.qubits
+        # Check if qargs straddle the registers in reglist.
+        # Only substitute if they do.
+        substitute = False
+        if obj.name in substitutable and len(qargs)==2: # Two qargs indicating 2-qb gate.
+            q0, q1 = qargs
+            substitute = (q0 in left and q1 in right) or (q1 in left and q0 in right)
+
+        if substitute:
+            # As addInstr, with the register checks done once above.
+            circuitChunks.extend(_remote_ops(_SUBST[obj.name], q0, q1, tuple(obj.params),
+                                             creg, qreg, eprReady))
+            eprReady = False
+        else:
+            if obj.name=='GenEPR' and qargs==eprQubits:
+                eprReady = True
+            elif eprReady and not eprSet.isdisjoint(qargs):
+                eprReady = False
+            circuitChunks.append(op)
     
     circ.data = circuitChunks
\ No newline at end of file